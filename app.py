@@ -1,14 +1,7 @@
 import streamlit as st
 import os
 import tempfile
-from dotenv import load_dotenv
-from epub_extract import process_epub
-from epub_create import create_epub
-from translate import translate_text
-from openai import OpenAI
-
-# Load environment variables from .env file
-load_dotenv()
+from translate import load_environment
 
 # Set page config at the very beginning
 st.set_page_config(page_title="EPUB Translator", layout="wide")
@@ -30,6 +23,9 @@ def get_api_key(key_name, env_var_name):
 def main():
     st.title("EPUB Translator")
 
+    # Load environment variables from .env file
+    load_environment()
+
     # Set up API key
     OPENAI_API_KEY = get_api_key("OpenAI", 'OPENAI_API_KEY')
     
@@ -41,6 +37,7 @@ def main():
 
     # Initialize client
     try:
+        from openai import OpenAI
         client = OpenAI(api_key=OPENAI_API_KEY)
     except Exception as e:
         st.error(f"Failed to initialize OpenAI client: {str(e)}")
@@ -50,6 +47,10 @@ def main():
     uploaded_file = st.file_uploader("Upload an EPUB file", type="epub")
 
     if uploaded_file is not None:
+        from epub_extract import process_epub
+        from epub_create import create_epub
+        from translate import translate_text
+
         # Create a temporary directory to store the uploaded file
         with tempfile.TemporaryDirectory() as temp_dir:
             epub_path = os.path.join(temp_dir, uploaded_file.name)
@@ -0,0 +1,314 @@
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+
+import translate
+from translate import load_soup, save_soup, iter_segments, build_batch_messages
+from request_sizing import RequestSizer, MAX_SEGMENTS
+from epub_extract import list_content_files, find_opf_near, find_book_identifier
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# Source tokens per request; see batch_sizer
+BATCH_TOKENS = 4096
+
+def book_documents(xhtml_dir):
+    """
+    Yield (document_key, file) for every content document of a book. The key
+    hashes the book's OPF identifier and the document's path relative to the
+    book root (the OPF's folder), so it stays the same when the book is
+    extracted again somewhere else. Books without an OPF fall back to the
+    content folder's name.
+    """
+    opf_path = find_opf_near(xhtml_dir)
+    root = Path(opf_path).parent if opf_path else Path(xhtml_dir).resolve()
+    book_id = find_book_identifier(opf_path) or Path(xhtml_dir).resolve().name
+    for file in list_content_files(xhtml_dir):
+        relative_path = file.resolve().relative_to(root).as_posix()
+        digest = hashlib.sha1(f"{book_id}\n{relative_path}".encode('utf-8')).hexdigest()[:16]
+        yield f"seg-{digest}", file
+
+def group_hash(texts):
+    return hashlib.sha1(json.dumps(texts, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+
+def group_id(document_key, start, texts):
+    """
+    Custom ID for the request translating `texts`, the segments of a document
+    from index `start` on. It ends with a hash of their source text, so an
+    import can tell when the segments have shifted since the export.
+    """
+    return f"{document_key}-{start:05d}-{start + len(texts):05d}-{group_hash(texts)}"
+
+def parse_group_id(custom_id):
+    """(document_key, start, end, text_hash) of a custom ID made by group_id"""
+    document_key, start, end, text_hash = custom_id.rsplit('-', 3)
+    return document_key, int(start), int(end), text_hash
+
+def catalog_documents(xhtml_dirs):
+    """Yield (document_key, segment texts) for every document of every book in `xhtml_dirs`"""
+    for xhtml_dir in xhtml_dirs:
+        for document_key, file in book_documents(xhtml_dir):
+            yield document_key, [text for text, _ in iter_segments(load_soup(file))]
+
+def batch_sizer(model):
+    """
+    Request limits for batch jobs. There is no feedback to adapt to, so groups
+    start at the largest size the synchronous path grows to, capped at
+    BATCH_TOKENS source tokens so replies are rarely truncated.
+    """
+    sizer = RequestSizer(model)
+    sizer.max_segments = MAX_SEGMENTS
+    sizer.max_tokens = min(BATCH_TOKENS, sizer.token_ceiling)
+    return sizer
+
+def batch_request(custom_id, texts, source_lang, target_lang, model):
+    """One line of a Batch API requests file, in the same format as translate_batch"""
+    return json.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model,
+            "messages": build_batch_messages(texts, source_lang, target_lang),
+            "response_format": {"type": "json_object"},
+        },
+    }, ensure_ascii=False) + "\n"
+
+def export_batch(xhtml_dirs, requests_jsonl, source_lang='en', target_lang='es', model=None):
+    """
+    Write Batch API requests for a book or catalog. Each request carries a run
+    of consecutive segments of one document, so the shared system prompt is
+    paid once per group rather than once per segment. Returns the number of
+    requests written.
+    """
+    model = model or translate.openai_model()
+    sizer = batch_sizer(model)
+    count = 0
+    with open(requests_jsonl, 'w', encoding='utf-8') as file:
+        for document_key, texts in catalog_documents(xhtml_dirs):
+            start = 0
+            while start < len(texts):
+                end = sizer.group_end(texts, start)
+                file.write(batch_request(group_id(document_key, start, texts[start:end]), texts[start:end],
+                                         source_lang, target_lang, model))
+                count += 1
+                start = end
+
+    logger.info(f"Exported {count} batch requests to {requests_jsonl}")
+    return count
+
+def submit_batch(requests_jsonl, outbox_dir=None):
+    """
+    Upload a requests file and start a batch; returns the batch ID.
+
+    With `outbox_dir` nothing is sent to the provider: the file is copied into
+    that directory and its stem is used as the batch ID, which is handy for
+    tests and for handing files to another machine.
+    """
+    if outbox_dir:
+        Path(outbox_dir).mkdir(parents=True, exist_ok=True)
+        shutil.copy2(requests_jsonl, Path(outbox_dir) / Path(requests_jsonl).name)
+        return Path(requests_jsonl).stem
+
+    with open(requests_jsonl, 'rb') as file:
+        uploaded = translate.get_client().files.create(file=file, purpose="batch")
+    batch = translate.get_client().batches.create(
+        input_file_id=uploaded.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+    )
+    logger.info(f"Submitted batch {batch.id} ({requests_jsonl})")
+    return batch.id
+
+def fetch_results(batch_id, results_jsonl, outbox_dir=None):
+    """
+    Download a finished batch's output (and error lines) to `results_jsonl`.
+    Returns False if the batch is not finished yet.
+
+    With `outbox_dir`, results are read from `<outbox_dir>/<batch_id>.results.jsonl`.
+    """
+    if outbox_dir:
+        source = Path(outbox_dir) / f"{batch_id}.results.jsonl"
+        if not source.is_file():
+            return False
+        shutil.copy2(source, results_jsonl)
+        return True
+
+    batch = translate.get_client().batches.retrieve(batch_id)
+    if batch.status != "completed":
+        logger.info(f"Batch {batch_id} is {batch.status}")
+        return False
+
+    with open(results_jsonl, 'w', encoding='utf-8') as file:
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                file.write(translate.get_client().files.content(file_id).text)
+    return True
+
+def read_results(results_paths):
+    """
+    Map custom ID to the list of translations for every successful line in the
+    results files, recording each response's token usage along the way.
+    """
+    translations = {}
+    for path in results_paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    continue
+                try:
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    group = json.loads(content)["translations"]
+                    if not isinstance(group, list):
+                        raise TypeError("translations is not a list")
+                except (KeyError, IndexError, TypeError, ValueError):
+                    logger.warning(f"Malformed result for {result.get('custom_id')}")
+                    continue
+                finally:
+                    translate.record_usage((response.get("body") or {}).get("usage"))
+                translations[result["custom_id"]] = [str(translation) for translation in group]
+    return translations
+
+def import_results(requests_jsonl, results_paths, xhtml_dirs, source_lang='en', target_lang='es',
+                   requeue_jsonl=None, allow_partial=False):
+    """
+    Write batch translations back into the content documents.
+
+    Requests not fully covered by successful results (no result, an error, or
+    a reply with the wrong number of translations) are returned. If
+    `requeue_jsonl` is given, their segments are written there for
+    resubmission, split in half so a truncated or miscounted reply gets a
+    smaller retry. Requests whose segment text no longer matches the document
+    (it was edited or re-extracted differently since the export) are returned
+    as well; they have to be exported again. Unless `allow_partial` is set,
+    documents are only touched once every request is covered, so a follow-up
+    import can pass the original results files together with the requeued
+    batch's results.
+    """
+    with open(requests_jsonl, 'r', encoding='utf-8') as file:
+        requests = {request["custom_id"]: request
+                    for request in (json.loads(line) for line in file if line.strip())}
+    translate.reset_usage()
+    results = read_results(results_paths)
+    translate.log_usage_report(f"Prompt cache for {requests_jsonl}")
+    documents = dict(catalog_documents(xhtml_dirs))
+
+    # (document_key, segment index) -> translation, from every usable result
+    translated = {}
+    for custom_id, translations in results.items():
+        document_key, start, end, text_hash = parse_group_id(custom_id)
+        texts = documents.get(document_key)
+        if texts is None or group_hash(texts[start:end]) != text_hash:
+            continue  # stale; the request it answers is reported as drifted below
+        if len(translations) != end - start:
+            logger.warning(f"{custom_id}: expected {end - start} translations, got {len(translations)}")
+            continue
+        for index, translation in enumerate(translations, start):
+            translated[(document_key, index)] = translation
+
+    drifted, missing = [], []
+    for custom_id in requests:
+        document_key, start, end, text_hash = parse_group_id(custom_id)
+        texts = documents.get(document_key)
+        if texts is None or group_hash(texts[start:end]) != text_hash:
+            drifted.append(custom_id)
+        elif any((document_key, index) not in translated for index in range(start, end)):
+            missing.append(custom_id)
+
+    if drifted:
+        logger.warning(
+            f"{len(drifted)} of {len(requests)} requests no longer match their segment text; "
+            f"export them again (first: {drifted[0]})"
+        )
+    if missing:
+        logger.warning(f"{len(missing)} of {len(requests)} requests have no usable result")
+        if requeue_jsonl:
+            with open(requeue_jsonl, 'w', encoding='utf-8') as file:
+                for custom_id in missing:
+                    document_key, start, end, _ = parse_group_id(custom_id)
+                    middle = (start + end + 1) // 2
+                    for part_start, part_end in ((start, middle), (middle, end)):
+                        texts = documents[document_key][part_start:part_end]
+                        if texts and any((document_key, index) not in translated
+                                         for index in range(part_start, part_end)):
+                            file.write(batch_request(group_id(document_key, part_start, texts), texts, source_lang,
+                                                     target_lang, requests[custom_id]["body"]["model"]))
+            logger.info(f"Wrote requeue file {requeue_jsonl}")
+    if (missing or drifted) and not allow_partial:
+        return missing + drifted
+
+    requested = set()
+    for custom_id in requests:
+        document_key, start, end, _ = parse_group_id(custom_id)
+        requested.update((document_key, index) for index in range(start, end))
+    for xhtml_dir in xhtml_dirs:
+        for document_key, file in book_documents(xhtml_dir):
+            soup = load_soup(file)
+            for index, (_, apply) in enumerate(iter_segments(soup)):
+                if (document_key, index) in translated:
+                    apply(translated[(document_key, index)])
+                elif (document_key, index) not in requested:
+                    logger.warning(f"{file.name} segment {index} was not part of this batch")
+            save_soup(soup, file, target_lang)
+            logger.info(f"Imported: {file}")
+
+    return missing + drifted
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Translate books through the OpenAI Batch API")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help="write a Batch API requests file")
+    export.add_argument('requests_jsonl')
+    export.add_argument('xhtml_dirs', nargs='+')
+    export.add_argument('--source-lang', default='en')
+    export.add_argument('--target-lang', default='es')
+    export.add_argument('--model')
+
+    submit = commands.add_parser('submit', help="upload a requests file and start the batch")
+    submit.add_argument('requests_jsonl')
+    submit.add_argument('--outbox', help="copy into this directory instead of uploading")
+
+    fetch = commands.add_parser('fetch', help="download a finished batch's results")
+    fetch.add_argument('batch_id')
+    fetch.add_argument('results_jsonl')
+    fetch.add_argument('--outbox', help="read results from this directory instead of the provider")
+
+    load = commands.add_parser('import', help="write results back into the documents")
+    load.add_argument('requests_jsonl')
+    load.add_argument('xhtml_dirs', nargs='+')
+    load.add_argument('--results', action='append', required=True, help="results file (repeatable)")
+    load.add_argument('--source-lang', default='en')
+    load.add_argument('--target-lang', default='es')
+    load.add_argument('--requeue', help="write requests with no result here")
+    load.add_argument('--allow-partial', action='store_true')
+
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(sys.argv[1:])
+
+    if args.command == 'export':
+        export_batch(args.xhtml_dirs, args.requests_jsonl, args.source_lang, args.target_lang, args.model)
+    elif args.command == 'submit':
+        print(submit_batch(args.requests_jsonl, args.outbox))
+    elif args.command == 'fetch':
+        if not fetch_results(args.batch_id, args.results_jsonl, args.outbox):
+            print(f"Batch {args.batch_id} is not finished yet.")
+            sys.exit(1)
+    elif args.command == 'import':
+        missing = import_results(args.requests_jsonl, args.results, args.xhtml_dirs, args.source_lang,
+                                 args.target_lang, args.requeue, args.allow_partial)
+        if missing and not args.allow_partial:
+            sys.exit(1)
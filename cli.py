@@ -0,0 +1,98 @@
+"""
+epub-translate: one entry point for extracting, translating, estimating and
+packing EPUB books.
+
+Only argparse is imported up front; each subcommand imports the modules it
+needs, and the OpenAI client is built on the first request. Keep it that way:
+scripts/bench_import_time.py checks the startup budget.
+"""
+import os
+import sys
+import logging
+import argparse
+
+def extract(args):
+    from epub_extract import process_epub
+    backup_path = args.backup_dir or f"{args.output_dir.rstrip('/')}_backup"
+    xhtml_path, ncx_path, opf_path = process_epub(args.epub, args.output_dir, backup_path)
+    print(f"XHTML/HTML folder: {xhtml_path}")
+    print(f"NCX file: {ncx_path}")
+    print(f"OPF file: {opf_path}")
+
+def translate(args):
+    if args.dry_run:
+        return estimate(args)
+    import translate as translator
+    if args.model:
+        os.environ["OPENAI_MODEL"] = args.model  # load_dotenv never overrides it
+    if args.hedge:
+        translator.enable_hedging()
+    translator.main(args.input_path, args.source_lang, args.target_lang, args.stream)
+
+def estimate(args):
+    from pathlib import Path
+    import translate as translator
+    from epub_extract import list_content_files
+
+    input_path = Path(args.input_path)
+    if input_path.suffix.lower() == '.epub':
+        import tempfile
+        from epub_extract import process_epub
+        with tempfile.TemporaryDirectory() as work_dir:
+            xhtml_path, _, _ = process_epub(str(input_path), f"{work_dir}/epub", f"{work_dir}/backup")
+            totals = translator.estimate_files(list_content_files(xhtml_path) if xhtml_path else [], args.model)
+    elif input_path.is_dir():
+        totals = translator.estimate_files(list_content_files(input_path), args.model)
+    else:
+        totals = translator.estimate_files([input_path], args.model)
+
+    print(f"Files: {totals['files']}")
+    print(f"Segments: {totals['segments']}")
+    print(f"Requests (at the initial request size): {totals['requests']}")
+    print(f"Prompt tokens (estimated): {totals['prompt_tokens']}")
+    print(f"Completion tokens (estimated): {totals['completion_tokens']}")
+
+def pack(args):
+    from epub_create import create_epub
+    create_epub(args.input_folder, args.output_epub)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='epub-translate', description="Translate EPUB books with OpenAI models")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('extract', help="unzip an EPUB and locate its content, NCX and OPF files")
+    command.add_argument('epub')
+    command.add_argument('output_dir')
+    command.add_argument('--backup-dir')
+    command.set_defaults(func=extract)
+
+    for name, func, help_text in (
+        ('translate', translate, "translate an .epub, a content directory or a single .html/.xhtml file"),
+        ('estimate', estimate, "count segments, requests and tokens without calling the API"),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('input_path')
+        command.add_argument('source_lang', nargs='?', default='en')
+        command.add_argument('target_lang', nargs='?', default='es')
+        command.add_argument('--model', help="model to use (defaults to OPENAI_MODEL)")
+        command.set_defaults(func=func)
+        if name == 'translate':
+            command.add_argument('--dry-run', action='store_true', help="only print the estimate")
+            command.add_argument('--stream', action=argparse.BooleanOptionalAction, default=None,
+                                 help="force (or disable) the streaming parser; by default large files stream")
+            command.add_argument('--hedge', action='store_true', help="hedge straggling requests")
+
+    command = commands.add_parser('pack', help="zip a folder back into an EPUB")
+    command.add_argument('input_folder')
+    command.add_argument('output_epub')
+    command.set_defaults(func=pack)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    args.func(args)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
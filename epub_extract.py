@@ -1,6 +1,8 @@
 import os
 import zipfile
 import re
+from pathlib import Path
+from urllib.parse import unquote
 
 def process_epub(epub_path, output_path, backup_path):
     # Ensure the output and backup directories exist
@@ -66,3 +68,64 @@ def find_file_by_pattern(directory, pattern):
             if re.match(pattern, file):
                 return os.path.join(root, file)
     return None
+
+def list_content_files(xhtml_dir):
+    """
+    Lists the .xhtml and .html files directly inside a directory, sorted by name
+    so that every pass over a book visits the documents in the same order.
+    The EPUB 3 nav document is left out; it is translated with the TOC.
+    """
+    nav_path = find_nav_file(find_opf_near(xhtml_dir))
+    nav_path = Path(nav_path).resolve() if nav_path else None
+    return sorted(
+        p for p in Path(xhtml_dir).iterdir()
+        if p.suffix.lower() in ('.html', '.xhtml') and p.resolve() != nav_path
+    )
+
+def find_opf_near(xhtml_dir, levels=3):
+    """
+    Finds the OPF package file in the content directory or one of its parents.
+    """
+    directory = Path(xhtml_dir).resolve()
+    for _ in range(levels):
+        opf_files = sorted(directory.glob('*.opf'))
+        if opf_files:
+            return str(opf_files[0])
+        directory = directory.parent
+    return None
+
+def find_nav_file(opf_path):
+    """
+    Finds the EPUB 3 navigation document declared in the OPF manifest
+    (the item with properties="nav"). Returns None for EPUB 2 books.
+    """
+    if not opf_path:
+        return None
+    with open(opf_path, 'r', encoding='utf-8') as file:
+        opf_content = file.read()
+
+    for item in re.findall(r'<item\b[^>]*>', opf_content):
+        properties = re.search(r'properties="([^"]*)"', item)
+        href = re.search(r'href="([^"]*)"', item)
+        if properties and href and 'nav' in properties.group(1).split():
+            nav_path = os.path.join(os.path.dirname(opf_path), unquote(href.group(1)))
+            return nav_path if os.path.isfile(nav_path) else None
+    return None
+
+def find_book_identifier(opf_path):
+    """
+    Returns the book's unique identifier from the OPF metadata (the
+    dc:identifier named by the package's unique-identifier attribute, or the
+    first dc:identifier). Returns None if there is none.
+    """
+    if not opf_path:
+        return None
+    with open(opf_path, 'r', encoding='utf-8') as file:
+        opf_content = file.read()
+
+    identifiers = re.findall(r'<dc:identifier\b([^>]*)>([^<]*)</dc:identifier>', opf_content)
+    unique = re.search(r'<package\b[^>]*\bunique-identifier="([^"]*)"', opf_content)
+    for attributes, value in identifiers:
+        if unique and re.search(rf'\bid="{re.escape(unique.group(1))}"', attributes):
+            return value.strip()
+    return identifiers[0][1].strip() if identifiers else None
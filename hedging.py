@@ -0,0 +1,146 @@
+import time
+import logging
+import threading
+from functools import partial
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+# Hedge once a request has run past this percentile of recent latencies, scaled
+# to its size: request sizes vary a thousandfold, so the window holds seconds
+# per token rather than raw latencies
+HEDGE_PERCENTILE = 0.95
+LATENCY_WINDOW = 200
+# Latencies needed before the percentile is trusted; until then nothing is hedged
+MIN_SAMPLES = 20
+# Never hedge sooner than this, whatever the percentile says
+MIN_HEDGE_DELAY = 2.0
+# Extra tokens spent on hedges, as a share of all tokens requested
+MAX_EXTRA_FRACTION = 0.05
+
+def run_in_background(fn):
+    """
+    Start `fn` on a daemon thread and return a Future for its result. Daemon
+    threads let the process exit without waiting for an abandoned straggler.
+    """
+    future = Future()
+    future.set_running_or_notify_cancel()
+    started = time.monotonic()
+
+    def target():
+        try:
+            result = fn()
+        except BaseException as e:
+            future.finished_at = time.monotonic()
+            future.latency = future.finished_at - started
+            future.set_exception(e)
+        else:
+            future.finished_at = time.monotonic()
+            future.latency = future.finished_at - started
+            future.set_result(result)
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+class Hedger:
+    """
+    Sends a duplicate of a request that is still running after the rolling
+    p95 latency per token times its size, and returns whichever copy answers
+    first. Request sizes count the whole request: prompt, payload and the
+    expected reply. Hedges are only sent while the extra tokens stay under
+    `max_extra_fraction` of all tokens sent.
+
+    The OpenAI client cannot abort a request in flight, so the losing copy is
+    abandoned rather than cancelled; its tokens count against the budget.
+    """
+
+    def __init__(self, max_extra_fraction=MAX_EXTRA_FRACTION):
+        self.max_extra_fraction = max_extra_fraction
+        self.per_token_latencies = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'tokens': 0, 'hedges': 0, 'hedge_tokens': 0, 'hedge_wins': 0,
+                      'skipped_for_budget': 0, 'seconds_saved': 0.0}
+
+    def seconds_per_token(self):
+        """The HEDGE_PERCENTILE latency per token, or None while there are too few samples"""
+        with self.lock:
+            if len(self.per_token_latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self.per_token_latencies)
+        return ordered[int(HEDGE_PERCENTILE * (len(ordered) - 1))]
+
+    def deadline(self, tokens):
+        """Seconds to wait before hedging a request of `tokens` tokens, or None while there are too few samples"""
+        per_token = self.seconds_per_token()
+        if per_token is None:
+            return None
+        return max(per_token * tokens, MIN_HEDGE_DELAY)
+
+    def observe(self, tokens, future):
+        """Done-callback: every finished copy, winner or not, feeds the latency window"""
+        if future.exception() is None:
+            with self.lock:
+                self.per_token_latencies.append(future.latency / max(tokens, 1))
+
+    def budget_allows(self, tokens):
+        with self.lock:
+            allowed = self.stats['hedge_tokens'] + tokens <= self.max_extra_fraction * self.stats['tokens']
+            if not allowed:
+                self.stats['skipped_for_budget'] += 1
+            return allowed
+
+    def call(self, request, tokens):
+        """
+        Run `request()`, hedging it if it straggles. `tokens` is the size of the
+        whole request (prompt plus expected completion).
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['tokens'] += tokens
+
+        primary = run_in_background(request)
+        primary.add_done_callback(partial(self.observe, tokens))
+        delay = self.deadline(tokens)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.budget_allows(tokens):
+            return primary.result()
+
+        with self.lock:
+            self.stats['hedges'] += 1
+            self.stats['hedge_tokens'] += tokens
+        logger.debug(f"Hedging a request still running after {delay:.1f}s")
+        hedge = run_in_background(request)
+        hedge.add_done_callback(partial(self.observe, tokens))
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in (primary, hedge):
+                if future in done and future.exception() is None:
+                    if future is hedge:
+                        self.record_win(primary, hedge)
+                    return future.result()
+        return primary.result()  # both failed: raise the primary's error
+
+    def record_win(self, primary, hedge):
+        """Credit the time saved once the abandoned primary eventually finishes"""
+        with self.lock:
+            self.stats['hedge_wins'] += 1
+
+        def credit(future):
+            with self.lock:
+                self.stats['seconds_saved'] += future.finished_at - hedge.finished_at
+
+        primary.add_done_callback(credit)
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+        requests = stats['requests']
+        return {
+            **stats,
+            'hedge_rate': stats['hedges'] / requests if requests else 0.0,
+            'extra_token_fraction': stats['hedge_tokens'] / stats['tokens'] if stats['tokens'] else 0.0,
+            'seconds_per_1k_tokens': self.seconds_per_token() * 1000 if self.seconds_per_token() else None,
+        }
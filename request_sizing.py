@@ -0,0 +1,139 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Context window and maximum output tokens per model. Names are matched by
+# longest prefix, so dated snapshots (gpt-4o-2024-08-06) use their family's limits.
+MODEL_LIMITS = {
+    'gpt-4.1': {'context': 1047576, 'output': 32768},
+    'gpt-4o': {'context': 128000, 'output': 16384},
+    'gpt-4o-mini': {'context': 128000, 'output': 16384},
+    'gpt-4-turbo': {'context': 128000, 'output': 4096},
+    'gpt-4': {'context': 8192, 'output': 4096},
+    'gpt-3.5-turbo': {'context': 16385, 'output': 4096},
+}
+DEFAULT_LIMITS = {'context': 16385, 'output': 4096}
+
+# Translations come back somewhat longer than their source; the JSON wrapping
+# of a batched reply adds a little more on top
+OUTPUT_EXPANSION = 1.5
+# Room left in the context window for the shared system prompt
+PROMPT_RESERVE_TOKENS = 2048
+
+INITIAL_SEGMENTS = 8
+INITIAL_TOKENS = 1024
+MAX_SEGMENTS = 64
+MIN_TOKENS = 64
+SEGMENT_STEP = 1
+TOKEN_STEP = 256
+DECREASE_FACTOR = 0.5
+# Limits only grow after a request that used at least this share of its token budget
+FULL_REQUEST_FRACTION = 0.5
+
+# A request is treated as congested if it takes longer than this, or if its
+# latency per token is this many times the running average
+SLOW_REQUEST_SECONDS = 45
+SLOW_TOKEN_FACTOR = 2.0
+# Smaller requests are dominated by fixed overhead, so their latency per token
+# is neither compared against nor folded into the running average
+MIN_LATENCY_SAMPLE_TOKENS = 256
+LATENCY_SMOOTHING = 0.2
+
+def model_limits(model):
+    """Context and output limits for `model`, falling back to DEFAULT_LIMITS"""
+    matches = [name for name in MODEL_LIMITS if model and model.startswith(name)]
+    if not matches:
+        return DEFAULT_LIMITS
+    return MODEL_LIMITS[max(matches, key=len)]
+
+def estimate_tokens(text):
+    """Rough token count, same estimate as the old split_text"""
+    return len(text) // 4 + 1
+
+class RequestSizer:
+    """
+    AIMD controller for how many segments and source tokens go into a single
+    request. Each clean, fast request grows both limits by a fixed step; an
+    error, a truncated reply or a congested request halves them. The token
+    limit never exceeds what the model's output and context limits allow.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        limits = model_limits(model)
+        self.token_ceiling = int(min(
+            limits['output'] / OUTPUT_EXPANSION,
+            (limits['context'] - PROMPT_RESERVE_TOKENS) / (1 + OUTPUT_EXPANSION),
+        ))
+        self.max_segments = INITIAL_SEGMENTS
+        self.max_tokens = min(INITIAL_TOKENS, self.token_ceiling)
+        self.seconds_per_token = None
+        self.stats = {'requests': 0, 'segments': 0, 'tokens': 0, 'errors': 0, 'truncated': 0,
+                      'slow': 0, 'increases': 0, 'decreases': 0}
+
+    def group_end(self, texts, start=0):
+        """
+        Index just past the longest run of `texts` from `start` that fits the
+        current limits. A single segment over the token limit still goes alone.
+        """
+        end = start
+        tokens = 0
+        while end < len(texts) and end - start < self.max_segments:
+            tokens += estimate_tokens(texts[end])
+            if end > start and tokens > self.max_tokens:
+                break
+            end += 1
+        return end
+
+    def record(self, segments, tokens, latency, ok=True, truncated=False):
+        """Feed back the outcome of one request of `segments` segments and `tokens` source tokens"""
+        self.stats['requests'] += 1
+        self.stats['segments'] += segments
+        self.stats['tokens'] += tokens
+
+        slow = False
+        if ok and not truncated:
+            slow = latency > SLOW_REQUEST_SECONDS
+            if tokens >= MIN_LATENCY_SAMPLE_TOKENS:
+                per_token = latency / tokens
+                if self.seconds_per_token is None:
+                    self.seconds_per_token = per_token
+                else:
+                    slow = slow or per_token > self.seconds_per_token * SLOW_TOKEN_FACTOR
+                    self.seconds_per_token += LATENCY_SMOOTHING * (per_token - self.seconds_per_token)
+
+        if not ok:
+            self.stats['errors'] += 1
+        if truncated:
+            self.stats['truncated'] += 1
+        if slow:
+            self.stats['slow'] += 1
+
+        if not ok or truncated or slow:
+            self.decrease()
+        elif segments >= self.max_segments or tokens >= self.max_tokens * FULL_REQUEST_FRACTION:
+            # Only grow when the request actually used the room it had
+            self.increase()
+
+    def increase(self):
+        self.max_segments = min(self.max_segments + SEGMENT_STEP, MAX_SEGMENTS)
+        self.max_tokens = min(self.max_tokens + TOKEN_STEP, self.token_ceiling)
+        self.stats['increases'] += 1
+
+    def decrease(self):
+        self.max_segments = max(int(self.max_segments * DECREASE_FACTOR), 1)
+        self.max_tokens = max(int(self.max_tokens * DECREASE_FACTOR), MIN_TOKENS)
+        self.stats['decreases'] += 1
+
+    def report(self):
+        """Settled limits and outcome counts since the sizer was created"""
+        requests = self.stats['requests']
+        return {
+            'model': self.model,
+            'segments_per_request': self.max_segments,
+            'tokens_per_request': self.max_tokens,
+            'token_ceiling': self.token_ceiling,
+            'average_segments': self.stats['segments'] / requests if requests else 0.0,
+            'seconds_per_1k_tokens': self.seconds_per_token * 1000 if self.seconds_per_token else None,
+            **self.stats,
+        }
@@ -0,0 +1,52 @@
+"""
+Startup-time check for short-lived invocations. Runs `python -X importtime`
+on the CLI and the translate module in fresh interpreters and fails if either
+goes over its budget or pulls in a heavy dependency at import time.
+
+Usage: python scripts/bench_import_time.py
+"""
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import time of the module itself, in milliseconds
+BUDGETS_MS = {'cli': 30, 'translate': 50}
+HEAVY_MODULES = ['openai', 'bs4', 'lxml', 'dotenv', 'streamlit', 'httpx', 'tiktoken']
+RUNS = 5
+
+def import_time_ms(module):
+    """Best-of-RUNS cumulative import time reported by -X importtime"""
+    best = None
+    for _ in range(RUNS):
+        stderr = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+            cwd=ROOT, check=True, capture_output=True, text=True,
+        ).stderr
+        for line in stderr.splitlines():
+            parts = [part.strip() for part in line.split('|')]
+            if len(parts) == 3 and parts[2] == module:
+                cumulative_us = int(parts[1])
+                best = cumulative_us if best is None else min(best, cumulative_us)
+    return best / 1000
+
+def heavy_imports(module):
+    output = subprocess.run(
+        [sys.executable, '-c', f"import sys, {module}; print(' '.join(sorted(sys.modules)))"],
+        cwd=ROOT, check=True, capture_output=True, text=True,
+    ).stdout.split()
+    return [name for name in HEAVY_MODULES if name in output]
+
+def main():
+    failed = False
+    for module, budget in BUDGETS_MS.items():
+        elapsed = import_time_ms(module)
+        heavy = heavy_imports(module)
+        status = 'ok' if elapsed <= budget and not heavy else 'FAIL'
+        failed |= status == 'FAIL'
+        print(f"{module:>10}: {elapsed:6.1f} ms (budget {budget} ms), heavy imports: {', '.join(heavy) or 'none'} [{status}]")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
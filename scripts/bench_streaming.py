@@ -0,0 +1,95 @@
+"""
+Peak memory of process_file vs process_file_streaming on synthetic single-file
+books of growing size. The translator is stubbed out, so no API calls are made.
+
+Usage: python scripts/bench_streaming.py [size_mb ...]
+"""
+import os
+import sys
+import json
+import resource
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEADER = """<?xml version='1.0' encoding='utf-8'?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>Benchmark</title></head>
+<body>
+"""
+PARAGRAPH = ("<p class=\"text\">Paragraph {0}: it was the best of times, it was the <i>worst</i> of times, "
+             "it was the age of wisdom, it was the age of foolishness.</p>\n")
+
+def write_document(path, size_mb):
+    target = size_mb * 1024 * 1024
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(HEADER)
+        written = len(HEADER)
+        index = 0
+        while written < target:
+            if index % 50 == 0:
+                chunk = f"<h2>Chapter {index // 50}</h2>\n"
+            else:
+                chunk = PARAGRAPH.format(index)
+            file.write(chunk)
+            written += len(chunk)
+            index += 1
+        file.write("</body>\n</html>\n")
+
+def run_one(mode, path):
+    """Translate `path` in this process and report peak RSS in MB"""
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    import logging
+    import translate
+    import translate_stream
+    logging.disable(logging.INFO)
+    # Every entry point that could reach the API: both paths batch through
+    # translate_segments, which calls translate_batch and translate_text
+    translate.translate_text = lambda text, source_lang, target_lang: text
+    translate.translate_batch = lambda texts, source_lang, target_lang: list(texts)
+    translate.translate_segments = lambda texts, source_lang, target_lang: list(texts)
+    translate.get_client = lambda: sys.exit("benchmark tried to call the API")
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if mode == 'streaming':
+        translate_stream.process_file_streaming(path, 'en', 'es')
+    else:
+        translate.process_file(path, 'en', 'es')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux
+    print(json.dumps({'baseline_mb': baseline / 1024, 'peak_mb': peak / 1024}))
+
+def main(sizes):
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size_mb in sizes:
+            for mode in ('whole', 'streaming'):
+                path = os.path.join(temp_dir, f"book_{size_mb}.html")
+                write_document(path, size_mb)
+                output = subprocess.run(
+                    [sys.executable, __file__, '--run', mode, path],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                results[(mode, size_mb)] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'size':>8} {'whole (MB)':>12} {'streaming (MB)':>15}")
+    for size_mb in sizes:
+        whole = results[('whole', size_mb)]
+        streaming = results[('streaming', size_mb)]
+        print(f"{size_mb:>6}MB {whole['peak_mb'] - whole['baseline_mb']:>12.1f} "
+              f"{streaming['peak_mb'] - streaming['baseline_mb']:>15.1f}")
+
+    growth = [results[('streaming', size_mb)]['peak_mb'] for size_mb in sizes]
+    if max(growth) > min(growth) * 1.25 + 5:
+        print("Streaming peak memory grows with document size.")
+        sys.exit(1)
+    print("Streaming peak memory is flat.")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        run_one(sys.argv[2], sys.argv[3])
+    else:
+        main([int(size) for size in sys.argv[1:]] or [2, 8, 32])
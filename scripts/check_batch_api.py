@@ -0,0 +1,136 @@
+"""
+Offline check for batch_api.py using the local outbox instead of the provider.
+
+1. Exporting the same book from two different extraction folders must give
+   identical request files, with several segments per request.
+2. A results file with a line missing and a reply with the wrong number of
+   translations leaves the documents alone and requeues exactly those two
+   groups, split in half; importing again with the requeued results
+   translates every segment.
+3. If a document changes after the export, the import reports the shifted
+   segments and writes nothing.
+
+Usage: python scripts/check_batch_api.py
+"""
+import os
+import sys
+import json
+import shutil
+import filecmp
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_TEXT = os.path.join(ROOT, 'scripts', 'fix_llm', 'text')
+SAMPLE_FILES = sorted(os.listdir(SAMPLE_TEXT))
+OPF = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="bookid">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier opf:scheme="calibre" xmlns:opf="http://www.idpf.org/2007/opf">calibre-1</dc:identifier>
+    <dc:identifier id="bookid">urn:uuid:check-batch-api</dc:identifier>
+    <dc:title>Check</dc:title>
+  </metadata>
+  <manifest/>
+</package>
+"""
+
+def make_book(temp_dir, name):
+    """Lay out an extracted book: <name>/OEBPS/content.opf and OEBPS/text/*.html"""
+    text_dir = os.path.join(temp_dir, name, 'OEBPS', 'text')
+    os.makedirs(text_dir)
+    for file in SAMPLE_FILES:
+        shutil.copy(os.path.join(SAMPLE_TEXT, file), text_dir)
+    with open(os.path.join(temp_dir, name, 'OEBPS', 'content.opf'), 'w', encoding='utf-8') as file:
+        file.write(OPF)
+    return text_dir
+
+def fake_provider(outbox, batch_id, skip=(), miscount=()):
+    """
+    Answer every request in the outbox, leaving out the lines numbered in
+    `skip` and dropping one translation from those in `miscount`
+    """
+    with open(os.path.join(outbox, f"{batch_id}.jsonl"), encoding='utf-8') as file:
+        requests = [json.loads(line) for line in file]
+    with open(os.path.join(outbox, f"{batch_id}.results.jsonl"), 'w', encoding='utf-8') as file:
+        for number, request in enumerate(requests):
+            if number in skip:
+                continue
+            # The user message is the language pair, a blank line and the JSON array
+            texts = json.loads(request["body"]["messages"][-1]["content"].split("\n\n", 1)[1])
+            translations = [f"[es] {text}" for text in texts]
+            if number in miscount:
+                translations.pop()
+            body = {
+                "choices": [{"message": {"content": json.dumps({"translations": translations})}}],
+                "usage": {"prompt_tokens": 1200, "completion_tokens": 40,
+                          "prompt_tokens_details": {"cached_tokens": 1024}},
+            }
+            file.write(json.dumps({"custom_id": request["custom_id"],
+                                   "response": {"status_code": 200, "body": body}}) + "\n")
+
+def segment_texts(text_dir):
+    from translate import load_soup, iter_segments
+    from epub_extract import list_content_files
+    return [text for file in list_content_files(text_dir) for text, _ in iter_segments(load_soup(file))]
+
+def main():
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("OPENAI_API_KEY", "check")
+    import batch_api
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = lambda *parts: os.path.join(temp_dir, *parts)
+        outbox = path('outbox')
+        first, second = make_book(temp_dir, 'first'), make_book(temp_dir, 'second')
+
+        count = batch_api.export_batch([first], path('requests.jsonl'), model='gpt-4o-mini')
+        batch_api.export_batch([second], path('again.jsonl'), model='gpt-4o-mini')
+        assert 3 < count < len(segment_texts(first)) / 2, f"{count} requests are not grouped"
+        assert filecmp.cmp(path('requests.jsonl'), path('again.jsonl'), shallow=False), \
+            "custom IDs depend on where the book was extracted"
+
+        with open(path('requests.jsonl'), encoding='utf-8') as file:
+            groups = [batch_api.parse_group_id(json.loads(line)["custom_id"]) for line in file]
+        # Fail two groups of several segments each, so both get split on requeue
+        failing = [number for number, (_, start, end, _) in enumerate(groups) if end - start > 1][:2]
+        batch_id = batch_api.submit_batch(path('requests.jsonl'), outbox)
+        fake_provider(outbox, batch_id, skip={failing[0]}, miscount={failing[1]})
+        assert batch_api.fetch_results(batch_id, path('results.jsonl'), outbox)
+
+        before = segment_texts(second)
+        missing = batch_api.import_results(path('requests.jsonl'), [path('results.jsonl')], [second],
+                                           requeue_jsonl=path('requeue.jsonl'))
+        assert len(missing) == 2, missing
+        assert segment_texts(second) == before, "documents touched despite missing results"
+        with open(path('requeue.jsonl'), encoding='utf-8') as file:
+            requeued = [batch_api.parse_group_id(json.loads(line)["custom_id"]) for line in file]
+        assert len(requeued) == 4, requeued
+        assert sum(end - start for _, start, end, _ in requeued) == \
+            sum(groups[number][2] - groups[number][1] for number in failing), requeued
+
+        requeue_id = batch_api.submit_batch(path('requeue.jsonl'), outbox)
+        assert not batch_api.fetch_results(requeue_id, path('requeue.results.jsonl'), outbox)
+        fake_provider(outbox, requeue_id)
+        assert batch_api.fetch_results(requeue_id, path('requeue.results.jsonl'), outbox)
+        missing = batch_api.import_results(path('requests.jsonl'),
+                                           [path('results.jsonl'), path('requeue.results.jsonl')], [second])
+        assert missing == [], missing
+        assert segment_texts(second) == [f"[es] {text}" for text in before]
+
+        # Drop the first paragraph of a document: every later index shifts
+        third = make_book(temp_dir, 'third')
+        document = os.path.join(third, 'part0006.html')
+        with open(document, encoding='utf-8') as file:
+            html = file.read()
+        start = html.index('<p')
+        with open(document, 'w', encoding='utf-8') as file:
+            file.write(html[:start] + html[html.index('</p>', start) + 4:])
+        before = segment_texts(third)
+        unusable = batch_api.import_results(path('requests.jsonl'),
+                                            [path('results.jsonl'), path('requeue.results.jsonl')], [third])
+        assert unusable, "shifted segments were not detected"
+        assert segment_texts(third) == before, "documents touched despite drifted segments"
+
+    print(f"OK: {count} grouped requests, stable IDs, requeue and drift detection work")
+
+if __name__ == "__main__":
+    main()
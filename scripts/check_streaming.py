@@ -0,0 +1,122 @@
+"""
+Regression check: the streaming parser must produce the same document as
+translate.process_file, and a file that XML parsers accept. Covers XHTML
+named entities (&nbsp;, &mdash;, ...), which the streaming parser sees without
+the XHTML DTD, entity-like text in comments and CDATA sections, xml:lang and
+epub:type attributes on blocks and containers, and the sample chapters,
+with the default translation window and with one small enough to flush
+several times per document.
+The translator is stubbed out, so no API calls are made.
+
+Usage: python scripts/check_streaming.py
+"""
+import os
+import re
+import sys
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_TEXT = os.path.join(ROOT, 'scripts', 'fix_llm', 'text')
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+ENTITY_DOCUMENT = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="en" lang="en">
+<head><title>Caf&eacute; &amp; more</title>
+<style type="text/css"><![CDATA[ p.note:before { content: "&nbsp;&amp;" } ]]></style></head>
+<body epub:type="bodymatter">
+<!-- keep &nbsp; as written -->
+<section xml:lang="en" epub:type="chapter">
+<div>Lead&nbsp;in<span>x</span>after&mdash;tail</div>
+<p xml:lang="fr" epub:type="epigraph">Hello&nbsp;world &amp; A&mdash;B<span>z</span> end&hellip;</p>
+<h2 epub:type="title">Chapter&nbsp;One</h2>
+</section>
+<p title="caf&eacute;">Q&uuml;ote &lt;tag&gt; &#8220;x&#x201D; done</p>
+<table summary="Prices&nbsp;&euro;"><tr><th>Na&iuml;ve</th></tr><tr><td>1&frac12;</td></tr></table>
+<p><img src="a.png" alt="Fig.&nbsp;1"/>&copy; 2024</p>
+</body>
+</html>
+"""
+
+def fake_translation(text):
+    return f"[es] {text}"
+
+# Segments per translate_segments call made by the streaming parser
+batch_sizes = []
+
+def stub_translator(translate):
+    def fake_segments(texts, source_lang, target_lang):
+        batch_sizes.append(len(texts))
+        return [fake_translation(text) for text in texts]
+
+    translate.translate_text = lambda text, source_lang, target_lang: fake_translation(text)
+    translate.translate_segments = fake_segments
+    translate.translate_batch = fake_segments
+
+def outline(path):
+    """
+    Tags with their attributes, comments, and the text with runs of ASCII
+    whitespace collapsed. The streaming writer emits CDATA sections as escaped
+    text, which XML parsers read the same, so the markers are left out.
+    """
+    from bs4 import Comment
+    from translate import load_soup
+    soup = load_soup(path)
+    tags = [(tag.name, dict(tag.attrs)) for tag in soup.find_all(True)]
+    comments = [str(comment) for comment in soup.find_all(string=lambda string: isinstance(string, Comment))]
+    text = re.sub(r'<!\[CDATA\[|\]\]>', '', soup.get_text())
+    return tags, comments, re.sub(r'[ \t\r\n]+', ' ', text).strip()
+
+def check_well_formed(path, tags):
+    """The streamed file must parse as XML, with xml:lang under the reserved prefix"""
+    from lxml import etree
+    root = etree.parse(path).getroot()
+    languages = [elem.get(XML_LANG) for elem in root.iter() if elem.get(XML_LANG)]
+    assert languages == [attrs['xml:lang'] for _, attrs in tags if 'xml:lang' in attrs], languages
+
+def compare(source, temp_dir):
+    import translate
+    import translate_stream
+    whole = os.path.join(temp_dir, 'whole.html')
+    streamed = os.path.join(temp_dir, 'streamed.html')
+    shutil.copy(source, whole)
+    shutil.copy(source, streamed)
+    translate.process_file(whole, 'en', 'es')
+    del batch_sizes[:]
+    translate_stream.process_file_streaming(streamed, 'en', 'es')
+    assert max(batch_sizes) <= translate_stream.WINDOW_SEGMENTS, batch_sizes
+
+    whole_tags, whole_comments, whole_text = outline(whole)
+    streamed_tags, streamed_comments, streamed_text = outline(streamed)
+    assert streamed_text == whole_text, f"{source}: text differs\n{whole_text!r}\n{streamed_text!r}"
+    assert streamed_tags == whole_tags, f"{source}: markup differs"
+    assert streamed_comments == whole_comments, f"{source}: comments differ\n{streamed_comments!r}"
+    check_well_formed(streamed, whole_tags)
+
+def main():
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("OPENAI_API_KEY", "check")
+    import logging
+    import translate
+    logging.disable(logging.INFO)
+    stub_translator(translate)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        entity_document = os.path.join(temp_dir, 'entities.html')
+        with open(entity_document, 'w', encoding='utf-8') as file:
+            file.write(ENTITY_DOCUMENT)
+        sources = [entity_document] + [
+            os.path.join(SAMPLE_TEXT, name) for name in sorted(os.listdir(SAMPLE_TEXT))
+        ]
+        import translate_stream
+        for window in (translate_stream.WINDOW_SEGMENTS, 3):
+            # A tiny window makes every document flush several times mid-way
+            translate_stream.WINDOW_SEGMENTS = window
+            for source in sources:
+                compare(source, temp_dir)
+
+    print(f"OK: streaming matches process_file on {len(sources)} documents")
+
+if __name__ == "__main__":
+    main()
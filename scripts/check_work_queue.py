@@ -0,0 +1,102 @@
+"""
+Multi-process check for work_queue.py. The translator is stubbed out, so no
+API calls are made.
+
+1. Slow workers: every request takes longer than the lease, so only the
+   heartbeat keeps units from being redelivered. Each unit must be delivered once.
+2. Crashing workers: workers die at random mid-unit and are restarted. Every
+   unit must still finish, and the assembled book must be fully translated.
+
+Usage: python scripts/check_work_queue.py [workers]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_TEXT = os.path.join(ROOT, 'scripts', 'fix_llm', 'text')
+LEASE_SECONDS = 1.0
+
+def run_worker(db_path, mode):
+    """Worker process body: stub the translator and drain the queue"""
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("OPENAI_API_KEY", "check")
+    import work_queue
+
+    def fake_translate_batch(texts, source_lang, target_lang):
+        if mode == 'slow':
+            time.sleep(LEASE_SECONDS * 1.5)
+        elif random.random() < 0.1:
+            os._exit(1)  # simulate a crash mid-unit
+        return [f"[{target_lang}] {text}" for text in texts]
+
+    work_queue.translate_batch = fake_translate_batch
+    work_queue.run_worker(db_path, lease_seconds=LEASE_SECONDS, poll_interval=0.2)
+
+def drain(db_path, mode, workers):
+    """Run `workers` processes until each exits cleanly, restarting crashed ones"""
+    command = [sys.executable, __file__, '--worker', mode, db_path]
+    processes = [subprocess.Popen(command, stderr=subprocess.DEVNULL) for _ in range(workers)]
+    restarts = 0
+    while processes:
+        for process in list(processes):
+            code = process.poll()
+            if code is None:
+                continue
+            processes.remove(process)
+            if code != 0:
+                restarts += 1
+                if restarts > 200:
+                    raise RuntimeError("workers keep crashing")
+                processes.append(subprocess.Popen(command, stderr=subprocess.DEVNULL))
+        time.sleep(0.1)
+    return restarts
+
+def make_book(temp_dir, name):
+    book = os.path.join(temp_dir, name)
+    shutil.copytree(SAMPLE_TEXT, os.path.join(book, 'text'))
+    with open(os.path.join(book, 'mimetype'), 'w') as file:
+        file.write('application/epub+zip')
+    return book
+
+def main(workers):
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault("OPENAI_API_KEY", "check")
+    import work_queue
+    from translate import load_soup, iter_segments
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'slow.db')
+        book = make_book(temp_dir, 'slow')
+        work_queue.enqueue_book(db_path, os.path.join(book, 'text'), 'en', 'es', unit_size=10)
+        drain(db_path, 'slow', workers)
+        attempts = [row[0] for row in sqlite3.connect(db_path).execute("SELECT attempts FROM units")]
+        assert work_queue.queue_status(db_path)['done'] == len(attempts), work_queue.queue_status(db_path)
+        assert max(attempts) == 1, f"units redelivered despite heartbeat: {attempts}"
+        print(f"slow workers: {len(attempts)} units, each delivered once")
+
+        db_path = os.path.join(temp_dir, 'crash.db')
+        book = make_book(temp_dir, 'crash')
+        work_queue.enqueue_book(db_path, os.path.join(book, 'text'), 'en', 'es', unit_size=5)
+        restarts = drain(db_path, 'crash', workers)
+        counts = work_queue.queue_status(db_path)
+        assert counts['done'] > 0 and counts['pending'] == counts['leased'] == counts['failed'] == 0, counts
+
+        output_epub = os.path.join(temp_dir, 'crash.epub')
+        work_queue.assemble(db_path, os.path.join(book, 'text'), book, output_epub)
+        assert os.path.isfile(output_epub)
+        for file in os.listdir(os.path.join(book, 'text')):
+            for text, _ in iter_segments(load_soup(os.path.join(book, 'text', file))):
+                assert text.startswith('[es] '), f"{file}: untranslated segment {text!r}"
+        print(f"crashing workers: {counts['done']} units done after {restarts} crashes, book assembled")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        run_worker(sys.argv[3], sys.argv[2])
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
@@ -1,44 +1,273 @@
 import os
 import sys
-from pathlib import Path
-from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-from openai import OpenAI, OpenAIError
+import json
 import time
 import logging
+from pathlib import Path
+from functools import partial
+from prompts import shared_prefix, load_glossary
+from request_sizing import RequestSizer, estimate_tokens, OUTPUT_EXPANSION
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Heavy dependencies (openai, bs4, dotenv, lxml) are imported where they are
+# first needed, so short-lived commands such as estimates start quickly.
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
+# Documents larger than this are translated with the streaming parser
+DEFAULT_STREAMING_THRESHOLD_BYTES = 4 * 1024 * 1024
+
+_environment_loaded = False
+_client = None
+_system_prompt = None
+_sizer = None
+_hedger = None
+_hedging_configured = False
+
+usage_totals = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+
+def load_environment():
+    """Load variables from .env once, the first time configuration is needed"""
+    global _environment_loaded
+    if not _environment_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _environment_loaded = True
+
+def get_client():
+    """The OpenAI client, built on first use"""
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        load_environment()
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
+
+def openai_model():
+    """Model name from the environment or .env file"""
+    load_environment()
+    return os.getenv("OPENAI_MODEL")
+
+def streaming_threshold():
+    load_environment()
+    return int(os.getenv("STREAMING_THRESHOLD_BYTES", DEFAULT_STREAMING_THRESHOLD_BYTES))
+
+def system_prompt():
+    """The shared instructions and glossary, built once so every request sends identical bytes"""
+    global _system_prompt
+    if _system_prompt is None:
+        load_environment()  # TRANSLATION_GLOSSARY may only be set in .env
+        _system_prompt = shared_prefix(load_glossary())
+    return _system_prompt
+
+def build_messages(text, source_lang, target_lang):
+    """
+    Chat messages for one translation request. The long, byte-stable system
+    prompt comes first so provider prompt caching can reuse it; the language
+    pair and the segment follow in the user message.
+    """
+    return [
+        {"role": "system", "content": system_prompt()},
+        {"role": "user", "content": f"Source language: {source_lang}\nTarget language: {target_lang}\n\n{text}"}
+    ]
+
+def record_usage(usage):
+    """Add one response's token usage (an SDK object or a plain dict) to the running totals"""
+    if usage is None:
+        return
+    if not isinstance(usage, dict):
+        usage = usage.model_dump()
+    details = usage.get('prompt_tokens_details') or {}
+    cached = details.get('cached_tokens') or 0
+
+    usage_totals['requests'] += 1
+    usage_totals['prompt_tokens'] += usage.get('prompt_tokens') or 0
+    usage_totals['cached_tokens'] += cached
+    usage_totals['completion_tokens'] += usage.get('completion_tokens') or 0
+    logger.debug(f"Prompt tokens: {usage.get('prompt_tokens')}, cached: {cached}")
+
+def reset_usage():
+    for key in usage_totals:
+        usage_totals[key] = 0
+
+def usage_report():
+    """
+    Token totals and cache-hit ratio since the last reset. Cached tokens are
+    the input tokens the provider did not reprocess; what they cost depends on
+    the model's cached-input price, so no cost figure is derived here.
+    """
+    prompt_tokens = usage_totals['prompt_tokens']
+    cached_tokens = usage_totals['cached_tokens']
+    return {
+        **usage_totals,
+        'cache_hit_ratio': cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+    }
+
+def log_usage_report(label):
+    report = usage_report()
+    logger.info(
+        f"{label}: {report['requests']} requests, {report['prompt_tokens']} prompt tokens, "
+        f"{report['cached_tokens']} served from the prompt cache ({report['cache_hit_ratio']:.1%})"
+    )
+
+def request_sizer():
+    """The adaptive request-size controller for the configured model, created on first use"""
+    global _sizer
+    if _sizer is None:
+        _sizer = RequestSizer(openai_model())
+    return _sizer
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def log_sizing_report(label):
+    report = request_sizer().report()
+    logger.info(
+        f"{label}: settled on {report['segments_per_request']} segments / {report['tokens_per_request']} tokens "
+        f"per request (ceiling {report['token_ceiling']}), {report['requests']} requests averaging "
+        f"{report['average_segments']:.1f} segments, {report['errors']} errors, {report['truncated']} truncated, "
+        f"{report['slow']} slow"
+    )
 
-# Get model from .env file
-OPENAI_MODEL = os.getenv("OPENAI_MODEL")
+def enable_hedging(max_extra_fraction=None):
+    """Hedge straggling requests from now on (see hedging.Hedger)"""
+    global _hedger, _hedging_configured
+    from hedging import Hedger, MAX_EXTRA_FRACTION
+    _hedger = Hedger(MAX_EXTRA_FRACTION if max_extra_fraction is None else max_extra_fraction)
+    _hedging_configured = True
+
+def hedger():
+    """The active Hedger, or None. Set TRANSLATE_HEDGING=1 to hedge straggling requests."""
+    global _hedging_configured
+    if not _hedging_configured:
+        load_environment()
+        if os.getenv("TRANSLATE_HEDGING", "").lower() in ('1', 'true', 'yes'):
+            max_extra = os.getenv("TRANSLATE_HEDGING_MAX_EXTRA")
+            enable_hedging(float(max_extra) if max_extra else None)
+        _hedging_configured = True
+    return _hedger
+
+def request_tokens(messages, source_tokens):
+    """Estimated size of a whole request: every message, plus the expected reply to `source_tokens`"""
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+    return prompt_tokens + int(source_tokens * OUTPUT_EXPANSION)
+
+def create_completion(source_tokens, **kwargs):
+    """Send a chat completion request translating about `source_tokens` tokens, hedged if hedging is enabled"""
+    request = partial(get_client().chat.completions.create, **kwargs)
+    if hedger() is None:
+        return request()
+    return _hedger.call(request, request_tokens(kwargs["messages"], source_tokens))
+
+def log_hedging_report(label):
+    if _hedger is None:
+        return
+    report = _hedger.report()
+    logger.info(
+        f"{label}: {report['hedges']} of {report['requests']} requests hedged ({report['hedge_rate']:.1%}), "
+        f"{report['hedge_wins']} won by the hedge, {report['extra_token_fraction']:.1%} extra tokens, "
+        f"at least {report['seconds_saved']:.1f}s saved"
+    )
 
 def translate_text(text, source_lang, target_lang):
+    from openai import OpenAIError
+    started = time.monotonic()
     try:
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": f"You are a translator. Translate the following text from {source_lang} to {target_lang}."},
-                {"role": "user", "content": text}
-            ]
+        response = create_completion(
+            estimate_tokens(text),
+            model=openai_model(),
+            messages=build_messages(text, source_lang, target_lang)
         )
+        record_usage(response.usage)
+        request_sizer().record(1, estimate_tokens(text), time.monotonic() - started,
+                               truncated=response.choices[0].finish_reason == 'length')
         translated_text = response.choices[0].message.content
         time.sleep(0.1)  # Add a 0.1-second delay after each API call
         return translated_text
     except OpenAIError as e:
+        request_sizer().record(1, estimate_tokens(text), time.monotonic() - started, ok=False)
         logger.error(f"OpenAI API error: {e}")
         return text  # Return original text if translation fails
 
+TRANSLATABLE_TAGS = ['p', 'title', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'th']
+
+HEADING_TAGS = ['title', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+
+# Source heading text -> translation, collected while chapters are translated
+# so that TOC labels with the same wording can reuse it instead of a new request
+heading_memory = {}
+
+def normalize_label(text):
+    return ' '.join(text.split())
+
+def remember_heading(source_text, translated_text):
+    heading_memory[normalize_label(source_text)] = translated_text
+
+def build_batch_messages(texts, source_lang, target_lang):
+    """
+    Chat messages asking for several segments to be translated in one request.
+    The reply format is described in the cached system prompt ("Batched
+    requests"), so the user message carries only the language pair and data.
+    """
+    return build_messages(json.dumps(texts, ensure_ascii=False), source_lang, target_lang)
+
+def translate_batch(texts, source_lang, target_lang):
+    """
+    Translate a list of segments with a single request and report the outcome
+    to the request sizer. If the reply is truncated or cannot be matched up with
+    the input, or the request is over the model's context length, the list is
+    split in half and each half retried. Other API errors leave the
+    segments untranslated, as translate_text does.
+    """
+    if not texts:
+        return []
+    if len(texts) == 1:
+        return [translate_text(texts[0], source_lang, target_lang)]
+    from openai import OpenAIError, BadRequestError
+
+    tokens = sum(estimate_tokens(text) for text in texts)
+    started = time.monotonic()
+    try:
+        response = create_completion(
+            tokens,
+            model=openai_model(),
+            messages=build_batch_messages(texts, source_lang, target_lang),
+            response_format={"type": "json_object"}
+        )
+        record_usage(response.usage)
+        if response.choices[0].finish_reason == 'length':
+            request_sizer().record(len(texts), tokens, time.monotonic() - started, truncated=True)
+            logger.warning(f"Batch reply for {len(texts)} segments was truncated")
+        else:
+            translations = json.loads(response.choices[0].message.content)["translations"]
+            if not isinstance(translations, list) or len(translations) != len(texts):
+                raise ValueError(f"expected {len(texts)} translations")
+            request_sizer().record(len(texts), tokens, time.monotonic() - started)
+            time.sleep(0.1)  # Add a 0.1-second delay after each API call
+            return [str(translation) for translation in translations]
+    except OpenAIError as e:
+        request_sizer().record(len(texts), tokens, time.monotonic() - started, ok=False)
+        logger.error(f"OpenAI API error: {e}")
+        # A group over the context length may fit once split. Anything else
+        # (authentication, quota, rate limits, outages, other invalid requests)
+        # fails the same way for smaller requests, so keep the originals
+        if not (isinstance(e, BadRequestError) and getattr(e, 'code', None) == 'context_length_exceeded'):
+            return list(texts)
+    except (ValueError, KeyError, TypeError) as e:
+        request_sizer().record(len(texts), tokens, time.monotonic() - started, ok=False)
+        logger.warning(f"Could not parse batch reply: {e}")
+
+    middle = len(texts) // 2
+    return (translate_batch(texts[:middle], source_lang, target_lang)
+            + translate_batch(texts[middle:], source_lang, target_lang))
+
+def translate_segments(texts, source_lang, target_lang):
+    """Translate many segments in requests sized by the adaptive controller"""
+    translations = []
+    while len(translations) < len(texts):
+        # Re-read the limits before every request so feedback applies immediately
+        end = request_sizer().group_end(texts, len(translations))
+        translations.extend(translate_batch(texts[len(translations):end], source_lang, target_lang))
+    return translations
+
 def should_translate(tag):
     """Determine if a tag's content should be translated"""
-    return tag.name in ['p', 'title', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'th']
+    return tag.name in TRANSLATABLE_TAGS
 
 def remove_inline_tags(tag):
     """Remove inline tags from within a tag, preserving only the text content"""
@@ -46,68 +275,160 @@ def remove_inline_tags(tag):
     tag.clear()
     tag.append(text_content)
 
-def translate_content(tag, source_lang, target_lang):
-    """Remove inline tags, translate the content, and replace the tag's content"""
-    remove_inline_tags(tag)
-    if tag.string and tag.string.strip():
-        translated_text = translate_text(tag.string.strip(), source_lang, target_lang)
-        tag.string.replace_with(translated_text)
-
-def translate_table(table, source_lang, target_lang):
-    """Translate table name and column headers, but skip rows"""
-    if table.get('summary'):
-        table['summary'] = translate_text(table['summary'], source_lang, target_lang)
-    
-    for th in table.find_all('th'):
-        translate_content(th, source_lang, target_lang)
+def replace_heading(string, source_text, translated_text):
+    remember_heading(source_text, translated_text)
+    string.replace_with(translated_text)
 
-def translate_html(soup, source_lang, target_lang):
-    """Translate the content of appropriate tags and handle tables specially"""
+def iter_segments(soup):
+    """Yield (text, apply) pairs for every translatable string, in document order.
+
+    Inline tags are flattened as a side effect, so walking the same file twice
+    always produces the same sequence of segments.
+    """
     for tag in soup.find_all(should_translate):
-        if tag.name != 'th':  # Skip 'th' tags as they'll be handled in translate_table
-            translate_content(tag, source_lang, target_lang)
-    
+        if tag.name != 'th':  # 'th' tags are yielded with their table below
+            remove_inline_tags(tag)
+            if tag.string and tag.string.strip():
+                text = tag.string.strip()
+                if tag.name in HEADING_TAGS:
+                    yield text, partial(replace_heading, tag.string, text)
+                else:
+                    yield text, tag.string.replace_with
+
     for table in soup.find_all('table'):
-        translate_table(table, source_lang, target_lang)
-    
+        if table.get('summary'):
+            yield table['summary'], partial(table.__setitem__, 'summary')
+        for th in table.find_all('th'):
+            remove_inline_tags(th)
+            if th.string and th.string.strip():
+                yield th.string.strip(), th.string.replace_with
+
     for img in soup.find_all('img', alt=True):
         if img['alt'].strip():
-            img['alt'] = translate_text(img['alt'], source_lang, target_lang)
+            yield img['alt'], partial(img.__setitem__, 'alt')
 
-def process_file(input_file, source_lang, target_lang):
-    logger.info(f"Processing file: {input_file}")
+def translate_html(soup, source_lang, target_lang):
+    """Translate the content of appropriate tags and handle tables specially"""
+    segments = list(iter_segments(soup))
+    translations = translate_segments([text for text, _ in segments], source_lang, target_lang)
+    for (_, apply), translated_text in zip(segments, translations):
+        apply(translated_text)
+
+def load_soup(input_file):
+    """Parse an HTML/XHTML content document"""
+    from bs4 import BeautifulSoup
     with open(input_file, 'r', encoding='utf-8') as file:
         html_content = file.read()
+    return BeautifulSoup(html_content, 'html.parser')
 
-    soup = BeautifulSoup(html_content, 'html.parser')
-    translate_html(soup, source_lang, target_lang)
-
+def save_soup(soup, output_file, target_lang):
+    """Tag the document with the target language and write it back out"""
     html_tag = soup.find('html')
     if html_tag:
         html_tag['lang'] = target_lang
 
-    with open(input_file, 'w', encoding='utf-8') as file:
+    with open(output_file, 'w', encoding='utf-8') as file:
         file.write(str(soup))
 
+def process_file(input_file, source_lang, target_lang):
+    logger.info(f"Processing file: {input_file}")
+    soup = load_soup(input_file)
+    translate_html(soup, source_lang, target_lang)
+    save_soup(soup, input_file, target_lang)
     logger.info(f"Translated: {input_file}")
 
-def main(input_path, source_lang='en', target_lang='es'):
+def translate_file(input_file, source_lang, target_lang, streaming=None):
+    """
+    Translate one document in place. Files larger than streaming_threshold()
+    (or any file, with streaming=True) go through the memory-bounded lxml path;
+    documents that are not well-formed XML fall back to process_file.
+    """
+    if streaming is None:
+        streaming = os.path.getsize(input_file) > streaming_threshold()
+    if streaming:
+        from lxml import etree
+        from translate_stream import process_file_streaming
+        try:
+            process_file_streaming(input_file, source_lang, target_lang)
+            return
+        except etree.XMLSyntaxError as e:
+            logger.warning(f"{input_file} is not well-formed XML ({e}), loading it whole instead")
+    process_file(input_file, source_lang, target_lang)
+
+def translate_book(epub_path, output_epub, work_dir, source_lang='en', target_lang='es', streaming=None):
+    """
+    Extract an EPUB into `work_dir`, translate its content documents, table of
+    contents and metadata, and pack the result as `output_epub`.
+    """
+    from epub_extract import process_epub, find_nav_file, list_content_files
+    from epub_create import create_epub
+    from translate_nav import translate_navigation
+
+    output_path = os.path.join(work_dir, 'epub')
+    backup_path = os.path.join(work_dir, 'backup')
+    xhtml_path, ncx_path, opf_path = process_epub(str(epub_path), output_path, backup_path)
+    nav_path = find_nav_file(opf_path)
+
+    heading_memory.clear()
+    if xhtml_path:
+        for file in list_content_files(xhtml_path):
+            translate_file(file, source_lang, target_lang, streaming)
+
+    translate_navigation(ncx_path, opf_path, nav_path, source_lang, target_lang)
+
+    create_epub(output_path, str(output_epub))
+
+def estimate_files(files, model=None):
+    """
+    Count segments and estimate requests and tokens for translating `files`,
+    without building a client or sending anything.
+    """
+    sizer = RequestSizer(model or openai_model())
+    prefix_tokens = estimate_tokens(system_prompt())
+    totals = {'files': 0, 'segments': 0, 'source_tokens': 0, 'requests': 0}
+    for file in files:
+        texts = [text for text, _ in iter_segments(load_soup(file))]
+        totals['files'] += 1
+        totals['segments'] += len(texts)
+        totals['source_tokens'] += sum(estimate_tokens(text) for text in texts)
+        start = 0
+        while start < len(texts):
+            start = sizer.group_end(texts, start)
+            totals['requests'] += 1
+    totals['prompt_tokens'] = totals['source_tokens'] + totals['requests'] * prefix_tokens
+    totals['completion_tokens'] = int(totals['source_tokens'] * OUTPUT_EXPANSION)
+    return totals
+
+def main(input_path, source_lang='en', target_lang='es', streaming=None):
     input_path = Path(input_path)
+    reset_usage()
     
     if input_path.is_file():
-        if input_path.suffix.lower() == '.html':
-            process_file(input_path, source_lang, target_lang)
+        if input_path.suffix.lower() in ('.html', '.xhtml'):
+            translate_file(input_path, source_lang, target_lang, streaming)
+        elif input_path.suffix.lower() == '.epub':
+            output_epub = input_path.with_name(f"{input_path.stem}_{target_lang}.epub")
+            import tempfile
+            with tempfile.TemporaryDirectory() as work_dir:
+                translate_book(input_path, output_epub, work_dir, source_lang, target_lang, streaming)
         else:
-            logger.error(f"Error: The file '{input_path}' is not an HTML file.")
+            logger.error(f"Error: The file '{input_path}' is not an HTML or EPUB file.")
     elif input_path.is_dir():
-        for file in input_path.glob('*.html'):
-            process_file(file, source_lang, target_lang)
+        # Same file list as estimate and the EPUB path: .html and .xhtml, nav document excluded
+        from epub_extract import list_content_files
+        for file in list_content_files(input_path):
+            translate_file(file, source_lang, target_lang, streaming)
     else:
         logger.error(f"Error: The path '{input_path}' is neither a file nor a directory.")
 
+    log_usage_report(f"Prompt cache for {input_path}")
+    log_sizing_report(f"Request sizing for {input_path}")
+    log_hedging_report(f"Hedging for {input_path}")
     logger.info("Translation complete.")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
     if len(sys.argv) < 2:
         print("Usage: python translate_simple.py <input_path> [source_lang] [target_lang]")
         sys.exit(1)
@@ -0,0 +1,90 @@
+import logging
+
+from lxml import etree
+
+import translate
+from translate import normalize_label
+
+logger = logging.getLogger(__name__)
+
+NAMESPACES = {
+    'ncx': 'http://www.daisy.org/z3986/2005/ncx/',
+    'xhtml': 'http://www.w3.org/1999/xhtml',
+    'opf': 'http://www.idpf.org/2007/opf',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+}
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+def set_text(elem, text):
+    """Replace an element's content (including inline children) with plain text"""
+    for child in list(elem):
+        elem.remove(child)
+    elem.text = text
+
+def element_text(elem):
+    return normalize_label(''.join(elem.itertext()))
+
+def collect_ncx(tree):
+    return tree.xpath('//ncx:docTitle/ncx:text | //ncx:navLabel/ncx:text', namespaces=NAMESPACES)
+
+def collect_nav(tree):
+    return tree.xpath('//xhtml:head/xhtml:title | //xhtml:nav//xhtml:a | //xhtml:nav//xhtml:li/xhtml:span | '
+                      '//xhtml:nav/xhtml:h1 | //xhtml:nav/xhtml:h2', namespaces=NAMESPACES)
+
+def collect_opf(tree):
+    return tree.xpath('//dc:title | //dc:description', namespaces=NAMESPACES)
+
+def set_language(tree, is_nav, target_lang):
+    """
+    Declare `target_lang` as the document's language: dc:language in the OPF,
+    xml:lang on the NCX and OPF package roots, and lang as well on the nav root
+    """
+    root = tree.getroot()
+    for language in tree.xpath('//dc:language', namespaces=NAMESPACES):
+        language.text = target_lang
+    if is_nav:
+        root.set('lang', target_lang)
+    if is_nav or root.get(XML_LANG) is not None or root.tag == f"{{{NAMESPACES['ncx']}}}ncx":
+        root.set(XML_LANG, target_lang)
+
+def translate_labels(labels, source_lang, target_lang):
+    """
+    Translate unique label texts. Labels that match a chapter heading translated
+    earlier in this run reuse that translation; the rest are grouped into as
+    few requests as the request sizer allows.
+    """
+    translations = {}
+    pending = []
+    for label in dict.fromkeys(labels):
+        if label in translate.heading_memory:
+            translations[label] = translate.heading_memory[label]
+        else:
+            pending.append(label)
+
+    logger.info(f"{len(translations)} labels reused from chapter headings, {len(pending)} to translate")
+    translations.update(zip(pending, translate.translate_segments(pending, source_lang, target_lang)))
+    return translations
+
+def translate_navigation(ncx_path, opf_path, nav_path, source_lang, target_lang):
+    """
+    Translate the NCX table of contents, the EPUB 3 nav document and the OPF
+    title/description in one pass, mark each with the target language, then
+    write the files back in place.
+    Any of the paths may be None.
+    """
+    documents = []
+    for path, collect in ((ncx_path, collect_ncx), (nav_path, collect_nav), (opf_path, collect_opf)):
+        if path:
+            tree = etree.parse(str(path))
+            documents.append((path, tree, [elem for elem in collect(tree) if element_text(elem)]))
+
+    labels = [element_text(elem) for _, _, elems in documents for elem in elems]
+    translations = translate_labels(labels, source_lang, target_lang)
+
+    for path, tree, elems in documents:
+        for elem in elems:
+            set_text(elem, translations[element_text(elem)])
+        set_language(tree, path == nav_path, target_lang)
+        tree.write(str(path), xml_declaration=True, encoding='utf-8')
+        logger.info(f"Translated navigation: {path}")
@@ -0,0 +1,301 @@
+import os
+import re
+import copy
+import logging
+from pathlib import Path
+from html.entities import html5
+
+from lxml import etree
+
+import translate
+from translate import TRANSLATABLE_TAGS
+from request_sizing import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Named references XML defines itself; everything else (&nbsp;, &mdash;, ...)
+# comes from the XHTML DTD, which the streaming parser does not load
+XML_ENTITIES = {b'amp', b'lt', b'gt', b'quot', b'apos'}
+XML_NAMESPACE = '{http://www.w3.org/XML/1998/namespace}'
+# Comments and CDATA sections are matched whole so that references inside them
+# are left alone; they are literal text there
+TOKEN_PATTERN = re.compile(rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|&([A-Za-z][A-Za-z0-9]*);', re.DOTALL)
+SPAN_START_PATTERN = re.compile(rb'<!--|<!\[CDATA\[')
+SPAN_ENDS = {b'<!--': b'-->', b'<![CDATA[': b']]>'}
+# Longest HTML entity name plus '&' and ';', with some room to spare
+MAX_ENTITY_LENGTH = 40
+READ_SIZE = 64 * 1024
+
+# Translated blocks are queued and sent in batches; the window is flushed once
+# it holds this many segments or source tokens (a few full-size requests), or
+# this many queued writes, which keeps memory bounded whatever the document
+WINDOW_SEGMENTS = 256
+WINDOW_TOKENS = 32 * 1024
+WINDOW_OPERATIONS = 4096
+
+def numeric_reference(match):
+    """
+    Numeric character reference for an HTML named entity; unknown names are
+    kept as text, and comments and CDATA sections are returned unchanged
+    """
+    name = match.group(1)
+    if name is None or name in XML_ENTITIES:
+        return match.group(0)
+    characters = html5.get(name.decode('ascii') + ';')
+    if characters is None:
+        return b'&amp;' + name + b';'
+    return ''.join(f'&#{ord(c)};' for c in characters).encode('ascii')
+
+def unfinished_tail(data):
+    """
+    Index where the end of `data` may hold an unfinished comment, CDATA
+    section or entity reference, or len(data) if it holds none
+    """
+    position = 0
+    while True:
+        match = SPAN_START_PATTERN.search(data, position)
+        if match is None:
+            break
+        end = data.find(SPAN_ENDS[match.group()], match.end())
+        if end == -1:
+            return match.start()
+        position = end + len(SPAN_ENDS[match.group()])
+
+    cut = len(data)
+    ampersand = data.rfind(b'&', max(len(data) - MAX_ENTITY_LENGTH, position))
+    if ampersand != -1 and b';' not in data[ampersand:]:
+        cut = ampersand
+    bracket = data.rfind(b'<', max(len(data) - len(b'<![CDATA['), position))
+    if bracket != -1 and any(start.startswith(data[bracket:]) for start in SPAN_ENDS):
+        cut = min(cut, bracket)
+    return cut
+
+class EntityFilter:
+    """
+    File-like wrapper that rewrites HTML named entities as numeric references
+    while the parser reads, the way html.parser resolves them for process_file.
+    Comments and CDATA sections pass through untouched. Anything that may
+    continue in the next chunk (a reference, a comment or a CDATA section) is
+    held back until it is complete.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.pending = b''
+
+    def read(self, size=READ_SIZE):
+        while True:
+            chunk = self.file.read(max(size, MAX_ENTITY_LENGTH))
+            data = self.pending + chunk
+            cut = unfinished_tail(data) if chunk else len(data)
+            self.pending = data[cut:]
+            # An empty read means end of file to the parser, so keep reading
+            # until something can be returned
+            if cut or not chunk:
+                return TOKEN_PATTERN.sub(numeric_reference, data[:cut])
+
+def local_name(elem):
+    return etree.QName(elem).localname
+
+def flatten_block(elem):
+    """lxml counterpart of translate.remove_inline_tags: keep only the stripped text"""
+    text_content = ''.join(s.strip() for s in elem.itertext() if s.strip())
+    for child in list(elem):
+        elem.remove(child)
+    elem.text = text_content
+    return text_content
+
+def release(elem):
+    """
+    Drop a finished element's children and every sibling before it. The element
+    itself stays until its next sibling starts, because that sibling's leading
+    text is stored as this element's tail.
+    """
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+def leading_text(elem):
+    """Text between the previous node (or the parent's start tag) and `elem`"""
+    previous = elem.getprevious()
+    if previous is not None:
+        return previous.tail
+    parent = elem.getparent()
+    return parent.text if parent is not None else None
+
+def trailing_text(elem):
+    """Text between the last child (or the start tag) and the end tag of `elem`"""
+    return elem[-1].tail if len(elem) else elem.text
+
+def output_attributes(elem):
+    """
+    Attributes of `elem` for xmlfile. xml:lang and the other xml:* attributes
+    are passed under the reserved prefix by name; given in {namespace} form,
+    xmlfile binds the XML namespace to a made-up prefix (ns0), which XML
+    parsers reject.
+    """
+    return {
+        f"xml:{name[len(XML_NAMESPACE):]}" if name.startswith(XML_NAMESPACE) else name: value
+        for name, value in elem.attrib.items()
+    }
+
+def new_namespaces(elem):
+    """Namespace declarations introduced by `elem` rather than inherited"""
+    parent = elem.getparent()
+    inherited = parent.nsmap if parent is not None else {}
+    return {prefix: uri for prefix, uri in elem.nsmap.items() if inherited.get(prefix) != uri}
+
+class PendingOutput:
+    """
+    Output held back until the segments it contains are translated. Closed
+    blocks, the text between them and the container tags around them are
+    queued as operations; once the window is full the queued segments go out
+    through translate.translate_segments (so the request sizer batches them)
+    and the operations are written in their original order.
+    """
+
+    def __init__(self, xf, source_lang, target_lang):
+        self.xf = xf
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.open_elements = []
+        self.operations = []
+        self.texts = []
+        self.tokens = 0
+
+    def segment(self, text):
+        """Queue `text` for translation and return its index in the window"""
+        self.texts.append(text)
+        self.tokens += estimate_tokens(text)
+        return len(self.texts) - 1
+
+    def write(self, *operation):
+        self.operations.append(operation)
+
+    def full(self):
+        return (len(self.texts) >= WINDOW_SEGMENTS or self.tokens >= WINDOW_TOKENS
+                or len(self.operations) >= WINDOW_OPERATIONS)
+
+    def flush(self):
+        translations = translate.translate_segments(self.texts, self.source_lang, self.target_lang)
+        for kind, *args in self.operations:
+            if kind == 'text':
+                self.xf.write(args[0])
+            elif kind == 'node':
+                self.xf.write(args[0], with_tail=False)
+            elif kind == 'doctype':
+                self.xf.write_doctype(args[0])
+            elif kind == 'open':
+                tag, attrib, nsmap, translated = args
+                attrib.update((name, translations[index]) for name, index in translated.items())
+                element = self.xf.element(tag, attrib, nsmap=nsmap)
+                element.__enter__()
+                self.open_elements.append(element)
+            elif kind == 'close':
+                self.open_elements.pop().__exit__(None, None, None)
+            elif kind == 'block':
+                tag, attrib, text, index, heading = args
+                if index is not None:
+                    if heading:
+                        translate.remember_heading(text, translations[index])
+                    text = translations[index]
+                with self.xf.element(tag, attrib):
+                    self.xf.write(text)
+        self.operations = []
+        self.texts = []
+        self.tokens = 0
+
+def stream_translate(input_file, output, source_lang, target_lang):
+    """
+    Translate an XHTML document from the binary stream `input_file` into the
+    binary stream `output`.
+
+    Block elements (TRANSLATABLE_TAGS) are flattened as soon as they close and
+    queued, together with everything written after them, in a bounded window
+    that is translated in batches and then written out. Finished elements are
+    released, so only the window, the current block and the chain of open
+    ancestors are held in memory.
+    """
+    context = etree.iterparse(
+        EntityFilter(input_file),
+        events=('start', 'end', 'comment', 'pi'),
+        huge_tree=True,
+        resolve_entities=False,
+        remove_comments=False,
+    )
+    with etree.xmlfile(output, encoding='utf-8') as xf:
+        xf.write_declaration()
+        pending = PendingOutput(xf, source_lang, target_lang)
+        depth = 0
+        block = None
+
+        for event, elem in context:
+            if block is not None:
+                if event == 'end' and elem is block:
+                    text = flatten_block(elem)
+                    index = pending.segment(text.strip()) if text.strip() else None
+                    pending.write('block', elem.tag, output_attributes(elem), text, index,
+                                  local_name(elem) in translate.HEADING_TAGS)
+                    release(elem)
+                    block = None
+            elif event in ('comment', 'pi'):
+                if elem.getparent() is not None:
+                    text = leading_text(elem)
+                    if text:
+                        pending.write('text', text)
+                node = copy.copy(elem)
+                node.tail = None
+                pending.write('node', node)
+            elif event == 'start':
+                if depth == 0:
+                    doctype = elem.getroottree().docinfo.doctype
+                    if doctype:
+                        pending.write('doctype', doctype)
+                text = leading_text(elem)
+                if text:
+                    pending.write('text', text)
+
+                name = local_name(elem)
+                if name in TRANSLATABLE_TAGS:
+                    block = elem
+                    continue
+                translated = {}
+                if name == 'html':
+                    elem.set('lang', target_lang)
+                elif name == 'table' and elem.get('summary'):
+                    translated['summary'] = pending.segment(elem.get('summary'))
+                elif name == 'img' and elem.get('alt', '').strip():
+                    translated['alt'] = pending.segment(elem.get('alt'))
+                pending.write('open', elem.tag, output_attributes(elem), new_namespaces(elem), translated)
+                depth += 1
+            else:
+                text = trailing_text(elem)
+                if text:
+                    pending.write('text', text)
+                pending.write('close')
+                depth -= 1
+                release(elem)
+
+            if pending.full():
+                pending.flush()
+        pending.flush()
+
+def process_file_streaming(input_file, source_lang, target_lang):
+    """
+    Memory-bounded variant of translate.process_file for very large XHTML
+    documents. The translation is written next to the input and only replaces
+    it once the whole document has been processed.
+    """
+    input_file = Path(input_file)
+    logger.info(f"Streaming file: {input_file}")
+    partial_file = input_file.with_name(input_file.name + '.part')
+    try:
+        with open(input_file, 'rb') as source, open(partial_file, 'wb') as output:
+            stream_translate(source, output, source_lang, target_lang)
+    except BaseException:
+        partial_file.unlink(missing_ok=True)
+        raise
+    os.replace(partial_file, input_file)
+    logger.info(f"Translated: {input_file}")
@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import threading
+import logging
+import argparse
+from pathlib import Path
+
+from translate import (
+    load_soup, save_soup, iter_segments, translate_batch, request_sizer,
+    log_usage_report, log_sizing_report, log_hedging_report,
+)
+from epub_create import create_epub
+from epub_extract import list_content_files, find_file_by_pattern, find_nav_file
+
+logger = logging.getLogger(__name__)
+
+# Segments per work unit, how long a claim lasts before another worker may
+# take the unit over, and how many deliveries a unit gets before it is parked
+UNIT_SIZE = 20
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+POLL_INTERVAL = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id INTEGER PRIMARY KEY,
+    xhtml_dir TEXT UNIQUE NOT NULL,
+    source_lang TEXT NOT NULL,
+    target_lang TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY,
+    book_id INTEGER NOT NULL REFERENCES books(id),
+    file TEXT NOT NULL,
+    first_segment INTEGER NOT NULL,
+    segments TEXT NOT NULL,
+    results TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS units_status ON units(status, lease_expires);
+"""
+
+def connect(db_path):
+    """
+    Open the queue database, creating the schema if needed.
+
+    Transactions are managed explicitly so that claims can take the write lock
+    up front with BEGIN IMMEDIATE. The default rollback journal is kept (rather
+    than WAL) so the file can live on shared storage.
+    """
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+def enqueue_book(db_path, xhtml_dir, source_lang='en', target_lang='es', unit_size=UNIT_SIZE):
+    """
+    Split every content document of a book into work units of at most
+    `unit_size` segments. Enqueueing the same directory twice is a no-op.
+    """
+    xhtml_dir = str(Path(xhtml_dir).resolve())
+    # Parse every document before taking the write lock, so workers claiming
+    # units of other books are not blocked for the length of the parse
+    units = []
+    for file in list_content_files(xhtml_dir):
+        texts = [text for text, _ in iter_segments(load_soup(file))]
+        for start in range(0, len(texts), unit_size):
+            units.append((file.name, start, json.dumps(texts[start:start + unit_size])))
+
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM books WHERE xhtml_dir = ?", (xhtml_dir,)).fetchone():
+            conn.execute("ROLLBACK")
+            logger.info(f"Already queued: {xhtml_dir}")
+            return 0
+
+        book_id = conn.execute(
+            "INSERT INTO books (xhtml_dir, source_lang, target_lang) VALUES (?, ?, ?)",
+            (xhtml_dir, source_lang, target_lang),
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO units (book_id, file, first_segment, segments) VALUES (?, ?, ?, ?)",
+            [(book_id, *unit) for unit in units],
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    logger.info(f"Queued {len(units)} work units for {xhtml_dir}")
+    return len(units)
+
+def claim_unit(conn, worker_id, lease_seconds=LEASE_SECONDS):
+    """
+    Lease the next available unit to `worker_id`. Units whose lease has expired
+    (their worker crashed or stalled) are redelivered. Returns None when nothing
+    can be claimed right now.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            """SELECT units.*, books.source_lang, books.target_lang
+               FROM units JOIN books ON books.id = units.book_id
+               WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+                 AND attempts < ?
+               ORDER BY units.id LIMIT 1""",
+            (now, MAX_ATTEMPTS),
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                """UPDATE units SET status = 'leased', worker = ?, lease_expires = ?,
+                   attempts = attempts + 1 WHERE id = ?""",
+                (worker_id, now + lease_seconds, row['id']),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+def extend_lease(conn, unit_id, worker_id, lease_seconds=LEASE_SECONDS):
+    """Push out the lease on a unit we still hold. Returns False if it was lost."""
+    cursor = conn.execute(
+        "UPDATE units SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+        (time.time() + lease_seconds, unit_id, worker_id),
+    )
+    return cursor.rowcount == 1
+
+def keep_lease(db_path, unit_id, worker_id, lease_seconds, stop, lost):
+    """
+    Heartbeat thread body: renew the lease every third of its length until
+    `stop` is set, so that a single slow request (SDK retries, split-and-retry)
+    cannot outlive the lease. Sets `lost` if another worker took the unit over.
+    """
+    conn = connect(db_path)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            if not extend_lease(conn, unit_id, worker_id, lease_seconds):
+                lost.set()
+                return
+    finally:
+        conn.close()
+
+def complete_unit(conn, unit_id, worker_id, results):
+    """Commit a unit's translations. Returns False if the lease went to another worker."""
+    cursor = conn.execute(
+        "UPDATE units SET status = 'done', results = ?, lease_expires = NULL "
+        "WHERE id = ? AND worker = ? AND status = 'leased'",
+        (json.dumps(results), unit_id, worker_id),
+    )
+    return cursor.rowcount == 1
+
+def queue_status(db_path):
+    """Count units by status; expired units that are out of attempts are reported as 'failed'"""
+    conn = connect(db_path)
+    try:
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        rows = conn.execute(
+            """SELECT CASE WHEN status = 'leased' AND attempts >= ? AND lease_expires < ?
+                           THEN 'failed' ELSE status END AS state,
+                      COUNT(*) AS n
+               FROM units GROUP BY state""",
+            (MAX_ATTEMPTS, time.time()),
+        )
+        for row in rows:
+            counts[row['state']] = row['n']
+        return counts
+    finally:
+        conn.close()
+
+def run_worker(db_path, worker_id=None, lease_seconds=LEASE_SECONDS, poll_interval=POLL_INTERVAL):
+    """
+    Claim, translate and commit units until the queue is drained. A heartbeat
+    thread keeps the lease on the current unit alive while it is translated.
+    While other workers still hold leases we keep polling, so that a unit
+    abandoned by a crashed worker is picked up once its lease expires.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    conn = connect(db_path)
+    completed = 0
+    try:
+        while True:
+            unit = claim_unit(conn, worker_id, lease_seconds)
+            if unit is None:
+                counts = queue_status(db_path)
+                if counts['pending'] == 0 and counts['leased'] == 0:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            logger.info(f"{worker_id}: unit {unit['id']} ({unit['file']} from segment {unit['first_segment']})")
+            texts = json.loads(unit['segments'])
+            results = []
+            stop = threading.Event()
+            lost = threading.Event()
+            heartbeat = threading.Thread(
+                target=keep_lease, args=(db_path, unit['id'], worker_id, lease_seconds, stop, lost), daemon=True,
+            )
+            heartbeat.start()
+            try:
+                while len(results) < len(texts) and not lost.is_set():
+                    end = request_sizer().group_end(texts, len(results))
+                    results.extend(translate_batch(texts[len(results):end], unit['source_lang'], unit['target_lang']))
+            finally:
+                stop.set()
+                heartbeat.join()
+
+            if lost.is_set() or not complete_unit(conn, unit['id'], worker_id, results):
+                logger.warning(f"{worker_id}: lost lease on unit {unit['id']}, discarding results")
+            else:
+                completed += 1
+    finally:
+        conn.close()
+
+    logger.info(f"{worker_id}: finished after completing {completed} units")
+    log_usage_report(f"Prompt cache for {worker_id}")
+    log_sizing_report(f"Request sizing for {worker_id}")
+    log_hedging_report(f"Hedging for {worker_id}")
+    return completed
+
+def assemble(db_path, xhtml_dir, epub_folder, output_epub):
+    """
+    Write the committed translations of a finished book back into its content
+    documents, translate the table of contents and metadata (reusing the chapter
+    headings just written), and pack the EPUB with `create_epub`.
+    """
+    xhtml_dir = Path(xhtml_dir).resolve()
+    conn = connect(db_path)
+    try:
+        book = conn.execute("SELECT * FROM books WHERE xhtml_dir = ?", (str(xhtml_dir),)).fetchone()
+        if book is None:
+            raise ValueError(f"Book not found in queue: {xhtml_dir}")
+
+        unfinished = conn.execute(
+            "SELECT COUNT(*) FROM units WHERE book_id = ? AND status != 'done'", (book['id'],)
+        ).fetchone()[0]
+        if unfinished:
+            raise RuntimeError(f"{unfinished} work units are not finished yet for {xhtml_dir}")
+
+        translations = {}
+        for unit in conn.execute(
+            "SELECT file, results FROM units WHERE book_id = ? ORDER BY file, first_segment", (book['id'],)
+        ):
+            translations.setdefault(unit['file'], []).extend(json.loads(unit['results']))
+    finally:
+        conn.close()
+
+    for file in list_content_files(xhtml_dir):
+        soup = load_soup(file)
+        results = translations.get(file.name, [])
+        segments = list(iter_segments(soup))
+        if len(segments) != len(results):
+            raise RuntimeError(
+                f"{file.name} has {len(segments)} segments but the queue holds {len(results)} translations"
+            )
+        for (_, apply), translated in zip(segments, results):
+            apply(translated)
+        save_soup(soup, file, book['target_lang'])
+        logger.info(f"Assembled: {file}")
+
+    from translate_nav import translate_navigation
+    opf_path = find_file_by_pattern(epub_folder, r'.*content\.opf$')
+    translate_navigation(
+        find_file_by_pattern(epub_folder, r'.*toc\.ncx$'), opf_path, find_nav_file(opf_path),
+        book['source_lang'], book['target_lang'],
+    )
+
+    create_epub(epub_folder, output_epub)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Share EPUB translation work between worker processes")
+    parser.add_argument('db_path', help="SQLite queue file (may live on shared storage)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help="split a book into work units")
+    enqueue.add_argument('xhtml_dir')
+    enqueue.add_argument('source_lang', nargs='?', default='en')
+    enqueue.add_argument('target_lang', nargs='?', default='es')
+    enqueue.add_argument('--unit-size', type=int, default=UNIT_SIZE)
+
+    work = commands.add_parser('work', help="translate units until the queue is drained")
+    work.add_argument('--worker-id')
+    work.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS)
+    work.add_argument('--poll-interval', type=float, default=POLL_INTERVAL)
+
+    commands.add_parser('status', help="show unit counts")
+
+    pack = commands.add_parser('assemble', help="write translations back and build the EPUB")
+    pack.add_argument('xhtml_dir')
+    pack.add_argument('epub_folder')
+    pack.add_argument('output_epub')
+
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(sys.argv[1:])
+
+    if args.command == 'enqueue':
+        enqueue_book(args.db_path, args.xhtml_dir, args.source_lang, args.target_lang, args.unit_size)
+    elif args.command == 'work':
+        run_worker(args.db_path, args.worker_id, args.lease_seconds, args.poll_interval)
+    elif args.command == 'status':
+        print(json.dumps(queue_status(args.db_path)))
+    elif args.command == 'assemble':
+        assemble(args.db_path, args.xhtml_dir, args.epub_folder, args.output_epub)